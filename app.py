@@ -1,18 +1,87 @@
+import asyncio
 import streamlit as st
 import google.generativeai as genai
 from PIL import Image
 import pandas as pd
 import json
+import orjson
 import os
 from dotenv import load_dotenv
 import docx
+from docx.oxml.ns import qn
 import fitz  # PyMuPDF
 import io
 import re
+import hashlib
+import llm_cache
+from pydantic import BaseModel, ValidationError, field_validator
 
 # Load environment variables from a .env file
 load_dotenv()
 
+# Upper bound on Gemini requests in flight at once across all files of a run, to stay clear of quota throttling
+MAX_CONCURRENT_REQUESTS = 8
+# Upper bound on uploaded files being extracted at once
+MAX_CONCURRENT_FILES = 4
+
+MODEL_NAME = 'gemini-2.5-flash' #gemini-1.5-flash-latest
+# Bump whenever the prompts change so stale cached responses are not reused
+PROMPT_VERSION = 'v2'
+CACHE_TTL_SECONDS = 7 * 86400
+
+IMAGE_PROMPT = "Extract all text and the primary table from this image as a JSON object with 'text' and 'table' keys. The 'table' value should be a list of lists."
+EMBEDDED_IMAGE_PROMPT = "This image was embedded in a document. Analyze it for tables. Provide output as a JSON object with 'text' and 'table' keys. The 'table' should be a list of lists."
+
+# Structured output schemas, so Gemini returns bare JSON matching PageExtract
+PAGE_EXTRACT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "text": {"type": "STRING"},
+        "table": {"type": "ARRAY", "items": {"type": "ARRAY", "items": {"type": "STRING"}}},
+    },
+}
+BATCH_EXTRACT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "pages": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"page": {"type": "INTEGER"}, **PAGE_EXTRACT_SCHEMA["properties"]},
+            },
+        },
+    },
+}
+
+# Consecutive PDF pages sent to Gemini in a single multi-image request
+PAGES_PER_REQUEST = 4
+BATCH_PROMPT_TEMPLATE = (
+    "The following {count} images are consecutive pages of one document. For each page: {prompt} "
+    "Return a single JSON object of the form "
+    "{{\"pages\": [{{\"page\": 1, \"text\": ..., \"table\": ...}}, ...]}} "
+    "with one entry per image, numbered from 1 in the order the images were given."
+)
+
+# Rendered PDF batches allowed to wait in the queue for a free request worker
+RENDER_AHEAD_BATCHES = 2
+
+# How many PDF pages to render between flushes of MuPDF's resource store
+STORE_SHRINK_INTERVAL = 16
+
+# PDF page rendering: pages are rasterized at the selected DPI with the long edge capped at
+# MAX_LONG_EDGE pixels (uploaded images are shrunk to the same cap); renders above
+# JPEG_MIN_PIXELS are sent as JPEG instead of PNG.
+DEFAULT_TARGET_DPI = 150
+DEFAULT_JPEG_QUALITY = 85
+MAX_LONG_EDGE = 2000
+JPEG_MIN_PIXELS = 3_000_000
+
+# MIME types Gemini accepts as inline image data; other images are re-encoded before sending
+GEMINI_IMAGE_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}
+
+# Characters stripped from table titles when building CSV file names
+_SAFE_NAME_RE = re.compile(r'[^a-z0-9_]+')
+
 def configure_api():
     """
     Configures the Google Generative AI API with the key from environment variables.
@@ -24,16 +93,34 @@ def configure_api():
         st.stop()
     genai.configure(api_key=api_key)
 
+def create_model(name=MODEL_NAME):
+    """
+    Configures the API and returns a Gemini model for one extraction run.
+    Deliberately not cached across runs: the model's async gRPC client is bound to the event loop
+    of its first request, and every run gets a fresh loop from asyncio.run. genai.configure also
+    resets genai's process-wide clients, so they are rebuilt on the new loop.
+    """
+    configure_api()
+    return genai.GenerativeModel(name)
+
+@st.cache_data(ttl=600)
+def _fetch_generate_content_models():
+    """
+    Fetches the models that support 'generateContent'. Cached for 10 minutes.
+    """
+    return [
+        {'Model Name': m.name, 'Description': m.description}
+        for m in genai.list_models()
+        if 'generateContent' in m.supported_generation_methods
+    ]
+
 def list_available_models():
     """
     Lists available Gemini models that support 'generateContent' and displays them in a table.
     """
     try:
         st.info("Fetching available models...")
-        models_list = []
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                models_list.append({'Model Name': m.name, 'Description': m.description})
+        models_list = _fetch_generate_content_models()
         
         if models_list:
             df = pd.DataFrame(models_list)
@@ -43,19 +130,212 @@ def list_available_models():
     except Exception as e:
         st.error(f"Could not retrieve the model list: {e}")
 
-def get_gemini_response(image, prompt):
+_JSON_DECODER = json.JSONDecoder()
+
+def parse_first_json_object(text):
     """
-    Calls the Gemini API to get text and table data from an image.
+    Returns the first JSON object embedded in the text, or None if there is none.
+    The common case of a single object, possibly fenced, is parsed in one pass with orjson;
+    otherwise surrounding chatter is tolerated by decoding incrementally from each '{'.
     """
-    model = genai.GenerativeModel('gemini-2.5-flash') #gemini-1.5-flash-latest
+    start = text.find('{')
+    if start == -1:
+        return None
     try:
-        response = model.generate_content([prompt, image])
-        return response.text
+        return orjson.loads(text[start:text.rfind('}') + 1])
+    except ValueError:
+        pass
+    while start != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, idx=start)
+            return obj
+        except json.JSONDecodeError:
+            start = text.find('{', start + 1)
+    return None
+
+class PageExtract(BaseModel):
+    """
+    Text and primary table extracted from one image or page, validated once at parse time.
+    Table cells are coerced to strings and rows padded to equal width, so tables can be
+    displayed and exported without further checks.
+    """
+    text: str = ''
+    table: list[list[str]] = []
+
+    @field_validator('text', mode='before')
+    @classmethod
+    def _coerce_text(cls, value):
+        return '' if value is None else value
+
+    @field_validator('table', mode='before')
+    @classmethod
+    def _coerce_table(cls, value):
+        if value is None:
+            return []
+        if not isinstance(value, list) or not all(isinstance(row, list) for row in value):
+            raise ValueError("table must be a list of lists")
+        width = max((len(row) for row in value), default=0)
+        return [['' if cell is None else str(cell) for cell in row] + [''] * (width - len(row)) for row in value]
+
+def parse_page_extract(text):
+    """
+    Returns the first JSON object in the text as a PageExtract, or None if there is no valid one.
+    """
+    obj = parse_first_json_object(text)
+    if obj is None:
+        return None
+    try:
+        return PageExtract.model_validate(obj)
+    except ValidationError:
+        return None
+
+def _to_image_part(image):
+    """
+    Normalizes a PIL image or a (mime_type, bytes) tuple into an inline Gemini content part.
+    Raw bytes are passed through untouched so they are not decoded and re-encoded. PIL images
+    are sent as lossless WebP, as google-generativeai does itself, after converting modes
+    WebP cannot store (e.g. CMYK scans) to RGB/RGBA.
+    """
+    if isinstance(image, tuple):
+        mime_type, data = image
+    else:
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        buf = io.BytesIO()
+        image.save(buf, 'WEBP', lossless=True)
+        mime_type, data = 'image/webp', buf.getvalue()
+    return {"mime_type": mime_type, "data": data}
+
+def _response_cache_key(image_parts, prompt):
+    """
+    Builds the response cache key from the image bytes, the prompt, and the model.
+    """
+    return hashlib.sha256(
+        b"".join(part["data"] for part in image_parts)
+        + prompt.encode() + MODEL_NAME.encode() + PROMPT_VERSION.encode()
+    ).hexdigest()
+
+async def get_gemini_response_async(image, prompt, model, request_semaphore, parse=parse_page_extract, response_schema=PAGE_EXTRACT_SCHEMA):
+    """
+    Calls the Gemini API, through a model from create_model, to get text and table data from an image.
+    request_semaphore is the run-wide cap on requests in flight; it is held only for the API call.
+    The image may be a PIL image or a (mime_type, bytes) tuple; a list of images is sent as a
+    single multi-image request. Being async, several requests can be in flight at once.
+    The response is requested as JSON matching response_schema and parsed with parse.
+    Returns (response_text, parsed); response_text is None if the API call failed, and parsed
+    is None if the response could not be parsed.
+    Responses are cached on disk, keyed by the image content and prompt, but only once they parse,
+    so an unusable reply is retried on the next run instead of being replayed.
+    """
+    images = image if isinstance(image, list) else [image]
+    image_parts = [_to_image_part(img) for img in images]
+    key = _response_cache_key(image_parts, prompt)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached, parse(cached)
+    try:
+        async with request_semaphore:
+            response = await model.generate_content_async(
+                [prompt, *image_parts],
+                generation_config={"response_mime_type": "application/json", "response_schema": response_schema},
+            )
+        response_text = response.text
     except Exception as e:
         st.error(f"An error occurred with the Gemini API: {e}")
-        return None
+        return None, None
+    parsed = parse(response_text)
+    if parsed is not None:
+        llm_cache.set(key, response_text, ttl=CACHE_TTL_SECONDS)
+    return response_text, parsed
+
+async def _analyze_embedded_images(indexed_blobs, prompt, status, model, request_semaphore):
+    """
+    Sends (index, blob, content_type) embedded images to Gemini concurrently and returns a dict of index -> PageExtract.
+    The PageExtract is None for images that could not be decoded or parsed.
+    Blobs in a format Gemini accepts are sent as-is; others are decoded with PIL first.
+    """
+    async def _analyze_blob(i, blob, content_type):
+        try:
+            if content_type in GEMINI_IMAGE_MIME_TYPES:
+                image = (content_type, blob)
+            else:
+                image = Image.open(io.BytesIO(blob))
+            response_text, data = await get_gemini_response_async(image, prompt, model, request_semaphore)
+        except Exception as e:
+            st.warning(f"Could not process embedded image {i + 1}. It might be a non-standard format. Error: {e}")
+            return i, None
+        status.write(f"Analyzed embedded image {i + 1}.")
+        if response_text and data is None:
+            st.warning(f"Could not parse data from embedded image {i + 1}. Skipping.")
+        return i, data
+
+    return dict(await asyncio.gather(*[_analyze_blob(*indexed_blob) for indexed_blob in indexed_blobs]))
+
+
+# WordprocessingML tag names used when reading native tables directly from the XML
+_W_TR, _W_TC, _W_P, _W_R, _W_HYPERLINK = qn('w:tr'), qn('w:tc'), qn('w:p'), qn('w:r'), qn('w:hyperlink')
+_W_T, _W_TAB, _W_BR, _W_CR, _W_NO_BREAK_HYPHEN = qn('w:t'), qn('w:tab'), qn('w:br'), qn('w:cr'), qn('w:noBreakHyphen')
+_W_VAL, _W_TYPE = qn('w:val'), qn('w:type')
+_W_GRID_SPAN_PATH = f"{qn('w:tcPr')}/{qn('w:gridSpan')}"
+_W_V_MERGE_PATH = f"{qn('w:tcPr')}/{qn('w:vMerge')}"
+
+def _run_text(r):
+    """
+    Returns a <w:r> run's text the way python-docx's Run.text renders it: tabs as '\t',
+    line breaks and carriage returns as '\n', non-breaking hyphens as '-'.
+    """
+    parts = []
+    for child in r:
+        if child.tag == _W_T:
+            parts.append(child.text or "")
+        elif child.tag == _W_TAB:
+            parts.append("\t")
+        elif child.tag == _W_CR or (child.tag == _W_BR and child.get(_W_TYPE, "textWrapping") == "textWrapping"):
+            parts.append("\n")
+        elif child.tag == _W_NO_BREAK_HYPHEN:
+            parts.append("-")
+    return "".join(parts)
+
+def _paragraph_text(p):
+    """
+    Returns a <w:p> paragraph's text from its runs, including runs inside hyperlinks.
+    """
+    return "".join(
+        "".join(_run_text(r) for r in child.iterchildren(_W_R)) if child.tag == _W_HYPERLINK else _run_text(child)
+        for child in p.iterchildren(_W_R, _W_HYPERLINK)
+    )
+
+def _cell_text(tc):
+    """
+    Returns a <w:tc> cell's text, one line per paragraph, matching python-docx's Cell.text.
+    """
+    return "\n".join(_paragraph_text(p) for p in tc.iterchildren(_W_P))
 
-def extract_data_from_docx(file_stream, prompt):
+def _read_table_rows(table):
+    """
+    Reads a Word table's cell texts straight from its XML, skipping python-docx's Row/Cell objects.
+    Like table.rows/row.cells, horizontally merged cells are repeated across their span and
+    vertically merged continuation cells repeat the text of the cell above.
+    """
+    rows = []
+    for tr in table._tbl.iterchildren(_W_TR):
+        row = []
+        for tc in tr.iterchildren(_W_TC):
+            span = tc.find(_W_GRID_SPAN_PATH)
+            width = int(span.get(_W_VAL)) if span is not None else 1
+            v_merge = tc.find(_W_V_MERGE_PATH)
+            if v_merge is not None and v_merge.get(_W_VAL, "continue") == "continue" and rows:
+                above = rows[-1]
+                col = len(row)
+                row.extend(above[c] if c < len(above) else "" for c in range(col, col + width))
+            else:
+                row.extend([_cell_text(tc)] * width)
+        rows.append(row)
+    return rows
+
+
+async def extract_data_from_docx_async(file_stream, prompt, model, request_semaphore):
     """
     Extracts text, native tables, and data from embedded images in a .docx file.
     Each table is stored as a separate dictionary in a list.
@@ -66,7 +346,7 @@ def extract_data_from_docx(file_stream, prompt):
 
     # 1. Extract native Word tables
     for i, table in enumerate(doc.tables):
-        table_data = [[cell.text for cell in row.cells] for row in table.rows]
+        table_data = _read_table_rows(table)
         all_tables_data.append({'title': f'Native Table {i+1}', 'data': table_data})
 
     # 2. Find and extract tables from embedded images
@@ -78,33 +358,137 @@ def extract_data_from_docx(file_stream, prompt):
 
     if image_parts:
         status = st.status(f"Found {len(image_parts)} embedded images. Analyzing...", expanded=True)
+
+        # Images reused across the document (logos, headers) are analyzed once, under the
+        # index of their first occurrence, and the result is shared by every occurrence.
+        first_index_by_hash = {}
+        first_indices = []
         for i, part in enumerate(image_parts):
-            status.write(f"Analyzing embedded image {i + 1}...")
-            try:
-                image = Image.open(io.BytesIO(part.blob))
-                response_text = get_gemini_response(image, prompt)
-                
-                if response_text:
-                    start_index = response_text.find('{')
-                    end_index = response_text.rfind('}')
-                    if start_index != -1 and end_index != -1:
-                        json_string = response_text[start_index:end_index+1]
-                        data = json.loads(json_string)
-                        img_text = data.get("text", "")
-                        img_table = data.get("table", [])
-
-                        if img_text:
-                            full_text.append(f"\n--- Text from Embedded Image {i + 1} ---\n{img_text}")
-                        if img_table:
-                            all_tables_data.append({'title': f'Table from Embedded Image {i+1}', 'data': img_table})
-            except Exception as e:
-                st.warning(f"Could not process embedded image {i + 1}. It might be a non-standard format. Error: {e}")
+            first_indices.append(first_index_by_hash.setdefault(hashlib.sha1(part.blob).digest(), i))
+        unique_blobs = [(i, image_parts[i].blob, image_parts[i].content_type) for i in first_index_by_hash.values()]
+
+        image_results = await _analyze_embedded_images(unique_blobs, prompt, status, model, request_semaphore)
+        for i, first_index in enumerate(first_indices):
+            data = image_results[first_index]
+            if data is None:
+                continue
+            img_text = data.text
+            img_table = data.table
+
+            if img_text:
+                full_text.append(f"\n--- Text from Embedded Image {i + 1} ---\n{img_text}")
+            if img_table:
+                all_tables_data.append({'title': f'Table from Embedded Image {i+1}', 'data': img_table})
         status.update(label="Image analysis complete!", state="complete")
 
     return "\n".join(full_text), all_tables_data
 
 
-def extract_data_from_pdf(file_stream, prompt):
+def _render_page(page, target_dpi, jpeg_quality):
+    """
+    Rasterizes a PDF page into a (mime_type, bytes) tuple sized for the Gemini API.
+    """
+    scale = min(target_dpi / 72, MAX_LONG_EDGE / max(page.rect.width, page.rect.height))
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    if pix.width * pix.height > JPEG_MIN_PIXELS:
+        rendered = ("image/jpeg", pix.tobytes("jpeg", jpg_quality=jpeg_quality))
+    else:
+        rendered = ("image/png", pix.tobytes("png"))
+    pix = None
+    return rendered
+
+
+def _split_batch_response(response_text, batch_size):
+    """
+    Splits a multi-page response into one PageExtract per page, in page order.
+    Returns None if the response does not contain exactly one valid entry per page.
+    """
+    data = parse_first_json_object(response_text) if response_text else None
+    entries = data.get("pages") if data is not None else None
+    if not isinstance(entries, list):
+        return None
+    by_page = {
+        entry["page"]: entry
+        for entry in entries
+        if isinstance(entry, dict) and isinstance(entry.get("page"), int)
+    }
+    if set(by_page) != set(range(1, batch_size + 1)):
+        return None
+    try:
+        return [PageExtract.model_validate(by_page[n]) for n in range(1, batch_size + 1)]
+    except ValidationError:
+        return None
+
+
+async def _analyze_pdf_pages(pdf_document, prompt, status, target_dpi, jpeg_quality, model, request_semaphore):
+    """
+    Sends the pages of the PDF to Gemini in batches of PAGES_PER_REQUEST, with the batches in flight concurrently.
+    Returns (page_num, PageExtract) pairs in page order; the PageExtract is None for pages that could not be parsed.
+
+    Rendering and requests run as a pipeline: one producer renders batches up to RENDER_AHEAD_BATCHES
+    ahead into a queue, while up to MAX_CONCURRENT_REQUESTS workers send them, so a worker that frees
+    up picks up an already-rendered batch instead of waiting on MuPDF. The requests themselves
+    also share request_semaphore with every other file in the run.
+    """
+    page_nums = range(pdf_document.page_count)
+    batches = [page_nums[i:i + PAGES_PER_REQUEST] for i in range(0, len(page_nums), PAGES_PER_REQUEST)]
+    num_workers = max(1, min(MAX_CONCURRENT_REQUESTS, len(batches)))
+    rendered_batches = asyncio.Queue(maxsize=RENDER_AHEAD_BATCHES)
+
+    async def _render_batches():
+        # PyMuPDF is not thread-safe, so pages are rendered on the event loop thread by this
+        # single producer; yielding between pages lets in-flight responses be handled meanwhile.
+        for batch in batches:
+            page_images = []
+            for page_num in batch:
+                page = pdf_document.load_page(page_num)
+                page_images.append(_render_page(page, target_dpi, jpeg_quality))
+                del page
+                if page_num % STORE_SHRINK_INTERVAL == 0:
+                    # Keep MuPDF's internal resource store from growing over long documents
+                    fitz.TOOLS.store_shrink(100)
+                await asyncio.sleep(0)
+            await rendered_batches.put((batch, page_images))
+        for _ in range(num_workers):
+            await rendered_batches.put(None)
+
+    async def _analyze_batch(page_nums, page_images):
+        if len(page_nums) == 1:
+            status.write(f"Analyzing page {page_nums[0] + 1}...")
+        else:
+            status.write(f"Analyzing pages {page_nums[0] + 1}-{page_nums[-1] + 1}...")
+
+        if len(page_nums) > 1:
+            batch_prompt = BATCH_PROMPT_TEMPLATE.format(count=len(page_nums), prompt=prompt)
+            _, page_data = await get_gemini_response_async(
+                page_images, batch_prompt, model, request_semaphore,
+                parse=lambda text: _split_batch_response(text, len(page_nums)),
+                response_schema=BATCH_EXTRACT_SCHEMA,
+            )
+            if page_data is not None:
+                return list(zip(page_nums, page_data))
+
+        # Single page, or the batched response could not be attributed to its pages. The pages
+        # are retried one by one so this worker still holds a single request at a time.
+        results = []
+        for page_num, page_image in zip(page_nums, page_images):
+            response_text, data = await get_gemini_response_async(page_image, prompt, model, request_semaphore)
+            if response_text and data is None:
+                st.warning(f"Could not parse data from page {page_num + 1}. Skipping.")
+            results.append((page_num, data))
+        return results
+
+    async def _send_batches():
+        results = []
+        while (item := await rendered_batches.get()) is not None:
+            results.extend(await _analyze_batch(*item))
+        return results
+
+    _, *worker_results = await asyncio.gather(_render_batches(), *[_send_batches() for _ in range(num_workers)])
+    return sorted((result for results in worker_results for result in results), key=lambda result: result[0])
+
+
+async def extract_data_from_pdf_async(file_stream, prompt, model, request_semaphore, target_dpi=DEFAULT_TARGET_DPI, jpeg_quality=DEFAULT_JPEG_QUALITY):
     """
     Extracts text and tables from a PDF by converting pages to images.
     Each table is stored as a separate dictionary in a list.
@@ -113,43 +497,196 @@ def extract_data_from_pdf(file_stream, prompt):
     aggregated_text = ""
     aggregated_tables = []
 
-    status = st.status(f"Processing {len(pdf_document)} pages...", expanded=True)
+    try:
+        status = st.status(f"Processing {pdf_document.page_count} pages...", expanded=True)
+        page_results = await _analyze_pdf_pages(pdf_document, prompt, status, target_dpi, jpeg_quality, model, request_semaphore)
+    finally:
+        pdf_document.close()
 
-    for page_num, page in enumerate(pdf_document):
-        status.write(f"Analyzing page {page_num + 1}...")
-        
-        pix = page.get_pixmap()
-        image = Image.open(io.BytesIO(pix.tobytes("png")))
-        
-        response_text = get_gemini_response(image, prompt)
+    for page_num, data in page_results:
+        if data is None:
+            continue
+        page_text = data.text
+        page_table = data.table
         
-        if response_text:
-            try:
-                start_index = response_text.find('{')
-                end_index = response_text.rfind('}')
-                if start_index != -1 and end_index != -1:
-                    json_string = response_text[start_index:end_index+1]
-                    data = json.loads(json_string)
-                    
-                    page_text = data.get("text", "")
-                    page_table = data.get("table", [])
-                    
-                    if page_text:
-                        aggregated_text += f"\n\n--- Page {page_num + 1} ---\n{page_text}"
-                    if page_table:
-                        aggregated_tables.append({'title': f'Table from Page {page_num + 1}', 'data': page_table})
-            except json.JSONDecodeError:
-                st.warning(f"Could not parse data from page {page_num + 1}. Skipping.")
+        if page_text:
+            aggregated_text += f"\n\n--- Page {page_num + 1} ---\n{page_text}"
+        if page_table:
+            aggregated_tables.append({'title': f'Table from Page {page_num + 1}', 'data': page_table})
 
     status.update(label="PDF processing complete!", state="complete")
     return aggregated_text, aggregated_tables
 
 
+def load_image(file_stream):
+    """
+    Opens and decodes an uploaded image once, shrinking it to at most MAX_LONG_EDGE pixels per side.
+    The result is shared by the preview and the Gemini request.
+    """
+    image = Image.open(file_stream)
+    image.load()
+    image.thumbnail((MAX_LONG_EDGE, MAX_LONG_EDGE), Image.LANCZOS)
+    return image
+
+
+async def extract_data_from_image_async(image, prompt, model, request_semaphore):
+    """
+    Extracts text and the primary table from an uploaded (already loaded) image.
+    The table, if any, is wrapped in the same list-of-dicts format as the other extractors.
+    """
+    text_result, table_result = "", []
+    response_text, data = await get_gemini_response_async(image, prompt, model, request_semaphore)
+    if response_text:
+        if data is not None:
+            text_result = data.text
+            if data.table:
+                table_result = [{'title': 'Table from Image', 'data': data.table}]
+        else: st.error("Failed to decode JSON from API.")
+    return text_result, table_result
+
+
+async def _process_file(uploaded_file, image, file_semaphore, model, request_semaphore, target_dpi, jpeg_quality):
+    """
+    Routes one uploaded file to the extractor for its type and returns (text, tables, error).
+    error is None on success, or a message describing why the file could not be processed.
+    image is the file's already loaded PIL image, if it was opened for the preview.
+    """
+    async with file_semaphore:
+        file_extension = os.path.splitext(uploaded_file.name)[1].lower()
+        uploaded_file.seek(0)
+        try:
+            if file_extension in [".jpg", ".jpeg", ".png"]:
+                if image is None:
+                    image = load_image(uploaded_file)
+                text, tables = await extract_data_from_image_async(image, IMAGE_PROMPT, model, request_semaphore)
+            elif file_extension == ".pdf":
+                text, tables = await extract_data_from_pdf_async(uploaded_file, IMAGE_PROMPT, model, request_semaphore, target_dpi, jpeg_quality)
+            elif file_extension == ".docx":
+                text, tables = await extract_data_from_docx_async(uploaded_file, EMBEDDED_IMAGE_PROMPT, model, request_semaphore)
+            else:
+                return "", [], f"Unsupported file type '{file_extension}'."
+        except Exception as e:
+            return "", [], str(e)
+        return text, tables, None
+
+
+async def process_files(uploaded_files, target_dpi, jpeg_quality, images=None):
+    """
+    Extracts every uploaded file concurrently, at most MAX_CONCURRENT_FILES at a time and with
+    at most MAX_CONCURRENT_REQUESTS Gemini requests in flight across all of them.
+    images optionally maps file ids to PIL images already loaded with load_image.
+    Returns a dict of file id -> {'name': ..., 'text': ..., 'tables': ..., 'error': ...}, keyed by
+    the upload's file_id since several uploads may share a name; 'error' is None for files that succeeded.
+    """
+    images = images or {}
+    # Built inside the run so its async client is bound to this run's event loop
+    model = create_model()
+    file_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES)
+    request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    results = await asyncio.gather(*[
+        _process_file(uploaded_file, images.get(uploaded_file.file_id), file_semaphore, model, request_semaphore,
+                      target_dpi, jpeg_quality)
+        for uploaded_file in uploaded_files
+    ])
+    return {
+        uploaded_file.file_id: {'name': uploaded_file.name, 'text': text, 'tables': tables, 'error': error}
+        for uploaded_file, (text, tables, error) in zip(uploaded_files, results)
+    }
+
+
+def _as_row_tuples(table_rows):
+    """
+    Converts a list-of-lists table into a tuple of tuples so it can serve as a cache key.
+    """
+    return tuple(tuple(row) for row in table_rows)
+
+@st.cache_data
+def rows_to_df(rows):
+    """
+    Builds a DataFrame from table rows, using the first row as the header when there is more than one row.
+    """
+    return pd.DataFrame(rows[1:], columns=rows[0]) if len(rows) > 1 else pd.DataFrame(rows)
+
+@st.cache_data
+def df_to_csv_bytes(rows):
+    """
+    Encodes table rows as UTF-8 CSV bytes for download.
+    """
+    return rows_to_df(rows).to_csv(index=False).encode('utf-8')
+
+
+def _show_results(file_index, file_name, text, tables_data):
+    """
+    Displays the extracted text and tables of one file, with its TXT and CSV downloads.
+    """
+    st.subheader("📝 Extracted Text")
+    st.text_area("Text Content", text, height=250, key=f"text_{file_index}")
+    
+    if tables_data:
+        st.subheader("📊 Extracted Tables")
+        for table_info in tables_data:
+            with st.container(border=True):
+                st.markdown(f"**{table_info['title']}**")
+                try:
+                    table_rows = table_info['data']
+                    if table_rows:
+                        st.dataframe(rows_to_df(_as_row_tuples(table_rows)))
+                    else:
+                        st.info("Table is empty.")
+                except Exception:
+                    st.warning("Could not format table. Displaying raw data.")
+                    st.json(table_info['data'])
+    else:
+        st.info("No tables were found in the file.")
+
+    st.markdown("---"); st.subheader("⬇️ Download Data")
+    
+    # Build the full text content for the TXT download
+    txt_buffer = io.StringIO()
+    txt_buffer.write(f"Extracted Text\n{'='*20}\n")
+    txt_buffer.write(text)
+    for table_info in tables_data:
+        txt_buffer.write(f"\n\n\n{table_info['title']}\n{'='*20}\n")
+        txt_buffer.write(pd.DataFrame(table_info['data']).to_string(index=False, header=False))
+    txt_content = txt_buffer.getvalue()
+    
+    txt_filename = f"{os.path.splitext(file_name)[0]}_extracted_content.txt"
+    st.download_button("Download All as TXT", txt_content, txt_filename, "text/plain",
+                       use_container_width=True, key=f"txt_dl_{file_index}")
+    
+    if tables_data:
+        st.markdown("---")
+        st.subheader("⬇️ Download Individual Tables as CSV")
+        for i, table_info in enumerate(tables_data):
+            try:
+                table_rows = table_info['data']
+                if table_rows and len(table_rows) > 1:
+                    # Sanitize title for filename
+                    safe_filename = _SAFE_NAME_RE.sub('', table_info['title'].lower().replace(' ', '_'))
+                    csv = df_to_csv_bytes(_as_row_tuples(table_rows))
+                    st.download_button(
+                        label=f"Download '{table_info['title']}'",
+                        data=csv,
+                        file_name=f"{safe_filename}.csv",
+                        mime="text/csv",
+                        key=f"csv_dl_{file_index}_{i}" # Unique key is important for multiple buttons
+                    )
+            except Exception:
+                st.warning(f"Could not generate CSV for '{table_info['title']}'.", icon="⚠️")
+
+
 def main():
     st.set_page_config(page_title="File Content Extractor", layout="wide", page_icon="📄")
 
     st.title("📄 File Content & Table Extractor")
-    st.markdown("Upload an Image, PDF, or Word document to extract its text and structured table data.")
+    st.markdown("Upload Images, PDFs, or Word documents to extract their text and structured table data.")
+
+    with st.sidebar:
+        st.header("PDF Rendering")
+        target_dpi = st.slider("Target DPI", 72, 300, DEFAULT_TARGET_DPI, step=6,
+                               help="Resolution PDF pages are rendered at before analysis.")
+        jpeg_quality = st.slider("JPEG Quality", 50, 100, DEFAULT_JPEG_QUALITY,
+                                 help="Quality used for very large pages, which are sent as JPEG instead of PNG.")
 
     with st.expander("Advanced Options"):
         if st.button("List Available Models"):
@@ -157,108 +694,48 @@ def main():
             list_available_models()
 
     st.markdown("---")
-    uploaded_file = st.file_uploader("Choose a file...", type=["jpg", "jpeg", "png", "pdf", "docx"])
+    uploaded_files = st.file_uploader("Choose files...", type=["jpg", "jpeg", "png", "pdf", "docx"],
+                                      accept_multiple_files=True)
 
-    if uploaded_file is not None:
+    if uploaded_files:
         col1, col2 = st.columns(2)
         
+        # Images are decoded once here and reused for the Gemini request
+        images = {f.file_id: load_image(f) for f in uploaded_files if f.type.startswith('image/')}
+
         with col1:
-            if uploaded_file.type.startswith('image/'):
-                st.image(Image.open(uploaded_file), caption="Uploaded Image", use_column_width=True)
-            else:
-                st.info(f"📄 Uploaded file: **{uploaded_file.name}**")
-                st.markdown("Preview is not available. Click 'Extract Data' to process.")
+            for uploaded_file in uploaded_files:
+                if uploaded_file.file_id in images:
+                    st.image(images[uploaded_file.file_id], caption=uploaded_file.name, use_column_width=True)
+                else:
+                    st.info(f"📄 Uploaded file: **{uploaded_file.name}**")
+            if not all(f.type.startswith('image/') for f in uploaded_files):
+                st.markdown("Preview is not available for documents. Click 'Extract Data' to process.")
 
         with col2:
             if st.button("✨ Extract Data", use_container_width=True):
-                with st.spinner("Analyzing file..."):
-                    configure_api()
-                    
-                    file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-                    text_result, table_result = "", []
-                    prompt_template = "Extract all text and the primary table from this image as a JSON object with 'text' and 'table' keys. The 'table' value should be a list of lists."
-
-                    if file_extension in [".jpg", ".jpeg", ".png"]:
-                        response_text = get_gemini_response(Image.open(uploaded_file), prompt_template)
-                        if response_text:
-                            try:
-                                start_index = response_text.find('{'); end_index = response_text.rfind('}')
-                                if start_index != -1 and end_index != -1:
-                                    data = json.loads(response_text[start_index:end_index+1])
-                                    text_result = data.get("text", "")
-                                    # Wrap single table in the expected list-of-dicts format
-                                    if data.get("table"):
-                                        table_result = [{'title': 'Table from Image', 'data': data.get("table")}]
-                            except json.JSONDecodeError: st.error("Failed to decode JSON from API.")
-                    
-                    elif file_extension == ".pdf":
-                        text_result, table_result = extract_data_from_pdf(uploaded_file, prompt_template)
-
-                    elif file_extension == ".docx":
-                        prompt_for_embeds = "This image was embedded in a document. Analyze it for tables. Provide output as a JSON object with 'text' and 'table' keys. The 'table' should be a list of lists."
-                        text_result, table_result = extract_data_from_docx(uploaded_file, prompt_for_embeds)
-                    
-                    st.session_state.extracted_text = text_result
-                    st.session_state.extracted_tables = table_result # Note the plural 'tables'
+                with st.spinner("Analyzing files..."):
+                    results = asyncio.run(process_files(uploaded_files, target_dpi, jpeg_quality, images))
+                    st.session_state['results'] = results
+                failed = [result['name'] for result in results.values() if result['error']]
+                if not failed:
                     st.success("Data extracted successfully!")
+                elif len(failed) == len(results):
+                    st.error("Could not extract data from any of the files.")
+                else:
+                    st.warning(f"Extracted {len(results) - len(failed)} of {len(results)} files. "
+                               f"Failed: {', '.join(failed)}.")
 
-    if 'extracted_text' in st.session_state:
+    if 'results' in st.session_state:
         st.markdown("---"); st.header("Extracted Results")
-        st.subheader("📝 Extracted Text")
-        st.text_area("Text Content", st.session_state.extracted_text, height=250)
-        
-        tables_data = st.session_state.get('extracted_tables', [])
-        if tables_data:
-            st.subheader("📊 Extracted Tables")
-            for table_info in tables_data:
-                with st.container(border=True):
-                    st.markdown(f"**{table_info['title']}**")
-                    try:
-                        table_rows = table_info['data']
-                        if table_rows and len(table_rows) > 1:
-                            df = pd.DataFrame(table_rows[1:], columns=table_rows[0])
-                            st.dataframe(df)
-                        elif table_rows:
-                             st.dataframe(pd.DataFrame(table_rows))
-                        else:
-                            st.info("Table is empty.")
-                    except Exception:
-                        st.warning("Could not format table. Displaying raw data.")
-                        st.json(table_info['data'])
-        else:
-            st.info("No tables were found in the file.")
-
-        st.markdown("---"); st.subheader("⬇️ Download Data")
-        
-        # Build the full text content for the TXT download
-        txt_content = f"Extracted Text\n{'='*20}\n{st.session_state.extracted_text}"
-        if tables_data:
-            for table_info in tables_data:
-                txt_content += f"\n\n\n{table_info['title']}\n{'='*20}\n"
-                txt_content += pd.DataFrame(table_info['data']).to_string(index=False, header=False)
-        
-        st.download_button("Download All as TXT", txt_content, "extracted_content.txt", "text/plain", use_container_width=True)
-        
-        if tables_data:
-            st.markdown("---")
-            st.subheader("⬇️ Download Individual Tables as CSV")
-            for i, table_info in enumerate(tables_data):
-                try:
-                    table_rows = table_info['data']
-                    if table_rows and len(table_rows) > 1:
-                        # Sanitize title for filename
-                        safe_filename = re.sub(r'[^a-z0-9_]+', '', table_info['title'].lower().replace(' ', '_'))
-                        csv = pd.DataFrame(table_rows[1:], columns=table_rows[0]).to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label=f"Download '{table_info['title']}'",
-                            data=csv,
-                            file_name=f"{safe_filename}.csv",
-                            mime="text/csv",
-                            key=f"csv_dl_{i}" # Unique key is important for multiple buttons
-                        )
-                except Exception:
-                    st.warning(f"Could not generate CSV for '{table_info['title']}'.", icon="⚠️")
+        results = st.session_state['results']
+        tabs = st.tabs([result['name'] for result in results.values()])
+        for file_index, (tab, result) in enumerate(zip(tabs, results.values())):
+            with tab:
+                if result['error']:
+                    st.error(f"Could not process '{result['name']}': {result['error']}")
+                else:
+                    _show_results(file_index, result['name'], result['text'], result['tables'])
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# On-disk location of the response cache, shared across sessions and documents
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".dockster_cache")
+CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+def _connect():
+    """
+    Opens a connection to the cache database, creating the file and table on first use.
+    A fresh connection is used per call so the cache can be used from worker threads.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, response BLOB, created_at INT, expires_at INT)"
+    )
+    return conn
+
+def get(key):
+    """
+    Returns the cached response for the key, or None if it is missing or expired.
+    """
+    try:
+        with closing(_connect()) as conn:
+            row = conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at > ?",
+                (key, int(time.time())),
+            ).fetchone()
+    except (sqlite3.Error, OSError):
+        return None
+    return row[0] if row else None
+
+def set(key, value, ttl):
+    """
+    Stores a response under the key for ttl seconds, replacing any previous entry.
+    Failures are ignored since the cache is only an optimization.
+    """
+    now = int(time.time())
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now + ttl),
+            )
+    except (sqlite3.Error, OSError):
+        pass